@@ -12,6 +12,7 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 NER_MODEL = os.getenv('NER_MODEL', 'asahi417/tner-xlm-roberta-large-ontonotes5')
+NUM_WORKERS = int(os.getenv('NUM_WORKERS', 0))
 DEBUG = False
 DUMMY = {
     'sentence': 'Jacob Collier lives in London',
@@ -36,7 +37,7 @@ async def process(request: Request):
     if DEBUG:
         ner_result = DUMMY
     else:
-        ner_result = MODEL.predict([input_text], max_seq_length=max_len)[0]
+        ner_result = MODEL.predict([input_text], max_seq_length=max_len, num_workers=NUM_WORKERS)[0]
     ner_result['html'] = generate_html(ner_result)
     return ner_result
 
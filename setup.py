@@ -43,7 +43,10 @@ setup(
         'seqeval',
         'segtok'
     ],
-    python_requires='>=3.6',
+    extras_require={
+        'onnx': ['onnx', 'onnxruntime']
+    },
+    python_requires='>=3.7',
     entry_points={
         'console_scripts': [
             'tner-train = tner_cl.train:main',
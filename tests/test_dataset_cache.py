@@ -0,0 +1,64 @@
+""" UnitTest for dataset cache """
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+from glob import glob
+logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+
+from tner.get_dataset import get_dataset_ner_single
+
+path_to_custom_data = './examples/custom_dataset_sample'
+
+
+class Test(unittest.TestCase):
+    """ Test cache of get_dataset_ner_single """
+
+    def setUp(self):
+        # work on a copy so that cache files are not written into the example directory
+        self.data_path = tempfile.mkdtemp()
+        for i in ['train.txt', 'valid.txt']:
+            shutil.copy(os.path.join(path_to_custom_data, i), self.data_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def cache_files(self):
+        return sorted(glob(os.path.join(self.data_path, 'tner_split.*.pkl')))
+
+    def test_split_cache(self):
+        first = get_dataset_ner_single(self.data_path)
+        self.assertEqual(len(self.cache_files()), 1)
+        self.assertEqual(get_dataset_ner_single(self.data_path), first)
+        # the cache is invalidated by a change of the file, and the outdated cache is removed
+        with open(os.path.join(self.data_path, 'valid.txt'), 'a') as f:
+            f.write('\n\nPeter B-PER\n\n')
+        second = get_dataset_ner_single(self.data_path)
+        self.assertEqual(second[0]['valid']['data'][-1], ['Peter'])
+        self.assertEqual(second[0]['train'], first[0]['train'])
+        self.assertEqual(len(self.cache_files()), 1)
+
+    def test_split_cache_config(self):
+        # training and evaluation (fixed label dict) keep their own cache
+        train = get_dataset_ner_single(self.data_path)
+        cache_train = self.cache_files()
+        label_to_id = {'O': 0, 'B-organization': 1, 'I-organization': 2}
+        test = get_dataset_ner_single(self.data_path, label_to_id=dict(label_to_id), fix_label_dict=True)
+        self.assertEqual(test[1], label_to_id)
+        self.assertEqual(len(self.cache_files()), 2)
+        mtime = os.stat(cache_train[0]).st_mtime_ns
+        self.assertEqual(get_dataset_ner_single(self.data_path), train)
+        # the training cache is hit, not rewritten
+        self.assertEqual(os.stat(cache_train[0]).st_mtime_ns, mtime)
+        self.assertEqual(len(self.cache_files()), 2)
+
+    def test_broken_cache(self):
+        first = get_dataset_ner_single(self.data_path)
+        open(self.cache_files()[0], 'w').close()
+        self.assertEqual(get_dataset_ner_single(self.data_path), first)
+        self.assertEqual(get_dataset_ner_single(self.data_path), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
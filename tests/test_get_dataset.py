@@ -0,0 +1,77 @@
+""" UnitTest for dataset decoding and formatting """
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+
+from tner.get_dataset import decode_file, conll_formatting
+
+path_to_custom_data = './examples/custom_dataset_sample'
+
+
+class Test(unittest.TestCase):
+    """ Test decode_file and conll_formatting """
+
+    def setUp(self):
+        # work on a copy so that test files are not written into the example directory
+        self.data_path = tempfile.mkdtemp()
+        for i in ['train.txt', 'valid.txt']:
+            shutil.copy(os.path.join(path_to_custom_data, i), self.data_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def decode(self, file_name='train.txt', **kwargs):
+        label_to_id, unseen, data = decode_file(file_name, self.data_path, **kwargs)
+        id_to_label = {v: k for k, v in label_to_id.items()}
+        return data['data'], [[id_to_label[i] for i in l] for l in data['label']], unseen
+
+    def test_to_bio(self):
+        tokens, labels, unseen = self.decode(label_to_id={}, fix_label_dict=False, to_bio=True, allow_new_entity=True)
+        self.assertEqual(len(tokens), 7)
+        self.assertEqual(tokens[:3], [
+            ['EU', 'rejects', 'German', 'call', 'to', 'boycott', 'British', 'lamb', '.'],
+            ['Peter', 'Blackburn'],
+            ['BRUSSELS', '1996-08-22']])
+        self.assertEqual(labels[:3], [
+            ['B-organization', 'O', 'B-TAG1', 'O', 'O', 'O', 'B-TAG1', 'O', 'O'],
+            ['B-TAG2', 'I-TAG2'],
+            ['B-location', 'O']])
+        self.assertEqual(unseen, set())
+
+    def test_fix_label_dict(self):
+        label_to_id = {'O': 0, 'B-organization': 1, 'I-organization': 2}
+        tokens, labels, unseen = self.decode(label_to_id=label_to_id, fix_label_dict=True)
+        # unknown labels are mapped to `O` and the label dict is kept as is
+        self.assertEqual(label_to_id, {'O': 0, 'B-organization': 1, 'I-organization': 2})
+        self.assertEqual(labels[0], ['B-organization'] + ['O'] * 8)
+        self.assertEqual(labels[2], ['O', 'O'])
+        self.assertEqual(labels[3][:3], ['O', 'B-organization', 'I-organization'])
+        self.assertEqual(unseen, set())
+
+    def test_trailing_sentence(self):
+        # a sentence without following blank line is not kept, but its labels are registered
+        with open(os.path.join(self.data_path, 'test.txt'), 'w') as f:
+            f.write('EU B-ORG\nrejects O\n\nPeter B-PER\nBlackburn I-PER')
+        label_to_id = {}
+        tokens, labels, _ = self.decode('test.txt', label_to_id=label_to_id, fix_label_dict=False)
+        self.assertEqual(tokens, [['EU', 'rejects']])
+        self.assertEqual(labels, [['B-organization', 'O']])
+        self.assertIn('B-person', label_to_id)
+        self.assertIn('I-person', label_to_id)
+
+
+    def test_conll_formatting(self):
+        output_file = os.path.join(self.data_path, 'test.txt')
+        conll_formatting(output_file, tokens=[['EU', 'rejects', '.', 'Peter'], ['BRUSSELS']],
+                         tags=[['B-ORG', 'O', 'O', 'B-PER'], ['B-LOC']], sentence_division='.')
+        with open(output_file) as f:
+            self.assertEqual(f.read(), 'EU B-ORG\nrejects O\n. O\n\nPeter B-PER\n\nBRUSSELS B-LOC\n\n')
+        tokens, labels, _ = self.decode('test.txt', label_to_id={}, fix_label_dict=False)
+        self.assertEqual(tokens, [['EU', 'rejects', '.'], ['Peter'], ['BRUSSELS']])
+        self.assertEqual(labels, [['B-organization', 'O', 'O'], ['B-person'], ['B-location']])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,26 @@
 """ UnitTest for dataset """
 import unittest
 import logging
+import tempfile
 logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
 
+import torch
+import transformers
 import tner
 from pprint import pprint
 
 transformers_model = 'asahi417/tner-xlm-roberta-large-ontonotes5'
+small_model = 'prajjwal1/bert-tiny'  # 4M parameters
+
+
+def save_small_model(model_dir):
+    """ save the small model with a fixed (randomly initialized) classification head, so that it can be loaded twice
+    with the same weights """
+    label2id = {'O': 0, 'B-LOC': 1, 'I-LOC': 2}
+    torch.manual_seed(0)
+    transformers.AutoModelForTokenClassification.from_pretrained(
+        small_model, label2id=label2id, id2label={v: k for k, v in label2id.items()}).save_pretrained(model_dir)
+    transformers.AutoTokenizer.from_pretrained(small_model).save_pretrained(model_dir)
 
 
 class Test(unittest.TestCase):
@@ -22,6 +36,45 @@ class Test(unittest.TestCase):
         test_result = model.predict(test_sentences)
         pprint(list(zip(test_sentences, test_result)))
 
+    def assert_same_prediction(self, result_a, result_b):
+        self.assertEqual(len(result_a), len(result_b))
+        for a, b in zip(result_a, result_b):
+            self.assertEqual(a['sentence'], b['sentence'])
+            self.assertEqual([(e['type'], e['position']) for e in a['entity']],
+                             [(e['type'], e['position']) for e in b['entity']])
+            for e_a, e_b in zip(a['entity'], b['entity']):
+                self.assertAlmostEqual(e_a['probability'], e_b['probability'], places=4)
+
+    def test_batch(self):
+        # the result for a sentence must not depend on the other sentences in its batch (padding) nor on the order
+        test_sentences = [
+            'I like to eat an apple.',
+            'I live in United States of America, and I have an Apple computer.',
+            'London',
+            'I have an Apple computer.'
+        ]
+        with tempfile.TemporaryDirectory() as model_dir:
+            save_small_model(model_dir)
+            model = tner.TransformersNER(model_dir, device='cpu')
+            result = model.predict(test_sentences, batch_size=len(test_sentences))
+            self.assert_same_prediction(result, model.predict(test_sentences, batch_size=1))
+            self.assert_same_prediction(result, [model.predict([x])[0] for x in test_sentences])
+
+    def test_onnx(self):
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            self.skipTest('onnxruntime is not installed')
+        test_sentences = [
+            'I live in United States.',
+            'I have an Apple computer.',
+            'I like to eat an apple.'
+        ]
+        with tempfile.TemporaryDirectory() as model_dir:
+            save_small_model(model_dir)
+            result_pt = tner.TransformersNER(model_dir, backend='pt', device='cpu').predict(test_sentences)
+            result_onnx = tner.TransformersNER(model_dir, backend='onnx').predict(test_sentences)
+        self.assert_same_prediction(result_pt, result_onnx)
 
 if __name__ == "__main__":
     unittest.main()
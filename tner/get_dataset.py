@@ -3,11 +3,20 @@ import os
 import zipfile
 import logging
 import re
+import hashlib
+import pickle
+import tempfile
 import requests
 import tarfile
 import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from operator import methodcaller
 from typing import Dict, List
-from itertools import chain
+from itertools import repeat
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from tqdm import tqdm
 from glob import glob
 from .japanese_tokenizer import SudachiWrapper
@@ -82,27 +91,133 @@ SHARED_NER_LABEL = {
     "chemical": ["Chemical"],  # bc5cdr
     "disease": ["Disease"]
 }
+# reverse lookup of SHARED_NER_LABEL (surface form -> unified label)
+_SURFACE_TO_CANONICAL = {surface: k for k, v in SHARED_NER_LABEL.items() for surface in v}
+# word or run of non-word characters trimmed of spaces, same tokens as splitting by `\b` and dropping spaces
+_TOKEN = re.compile(r'\w+|[^\w ](?:\W*[^\w ])?')
+# a blank line or a `-DOCSTART-` line in CoNLL format
+_SENTENCE_BOUNDARY = re.compile(r'^[^\S\n]*(?:-DOCSTART-[^\n]*\n?|\n|[^\S\n]\Z)', re.MULTILINE)
+# bump when the decoding/post-processing logic changes so that existing dataset caches are not reused
+_CACHE_VERSION = 1
+_SPLIT_CACHE_PREFIX, _SPLIT_CACHE_SUFFIX = 'tner_split.', '.pkl'
+
+# shared HTTP session to reuse connections across downloads
+_SESSION = requests.Session()
+for _prefix in ['http://', 'https://']:
+    _SESSION.mount(_prefix, HTTPAdapter(
+        pool_connections=16, pool_maxsize=16, max_retries=Retry(total=3, backoff_factor=0.5)))
+_lower = methodcaller('lower')
+# Sudachi tokenizer loads a large dictionary, so it is instantiated once per process (see `_get_sudachi`)
+_SUDACHI = None
+# per-process state for Japanese post-processing (see `_init_sudachi`)
+_SUDACHI_WORKER = None
 
 __all__ = ("get_dataset_ner", "VALID_DATASET", "SHARED_NER_LABEL")
 
 
-def open_compressed_file(url, cache_dir):
+def open_compressed_file(url, cache_dir, members: List = None):
+    """ download and extract a compressed file, only the given `members` are extracted if specified """
     path = wget(url, cache_dir)
     if path.endswith('.tar.gz') or path.endswith('.tgz'):
         tar = tarfile.open(path, "r:gz")
-        tar.extractall(cache_dir)
+        if members is None:
+            tar.extractall(cache_dir)
+        else:
+            for m in tar:
+                if m.name in members:
+                    tar.extract(m, cache_dir)
         tar.close()
     elif path.endswith('.zip'):
         with zipfile.ZipFile(path, 'r') as zip_ref:
-            zip_ref.extractall(cache_dir)
+            if members is None:
+                zip_ref.extractall(cache_dir)
+            else:
+                for m in members:
+                    zip_ref.extract(m, cache_dir)
+
+
+def _cache_key(files: List, *args):
+    """ key of a dataset cache in two parts, the first one changes when the arguments, the shared label set or the
+    cache version change, and the second one changes when any of the files change """
+    stats = [(os.stat(i).st_mtime_ns, os.stat(i).st_size) for i in files]
+    args = [tuple(sorted(a.items())) if type(a) is dict else a for a in args]
+    version = (_CACHE_VERSION, sorted(SHARED_NER_LABEL.items()), STOPWORDS)
+    return [hashlib.blake2b(repr(i).encode()).hexdigest()[:16] for i in [(version, args), stats]]
+
+
+def _load_cache(cache_file: str):
+    """ load the cache, return None if it does not exist or is broken (it will be rebuilt) """
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError):
+        logging.warning('failed to load dataset cache, rebuild it: {}'.format(cache_file))
+        return None
+
+
+def _dump_cache(obj, cache_file: str, prefix: str, suffix: str):
+    """ write the cache atomically and remove the outdated caches of the same target (files in the same directory
+    named as `prefix`*`suffix`), failing to write is not fatal (eg. read-only dataset directory) """
+    cache_dir, name = os.path.split(cache_file)
+    tmp = None
+    try:
+        # unique per process, so that concurrent writes don't go into the same file
+        fd, tmp = tempfile.mkstemp(dir=cache_dir or '.', prefix=name, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f)
+        os.replace(tmp, cache_file)
+    except OSError:
+        logging.warning('failed to write dataset cache: {}'.format(cache_file))
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        return
+    for i in os.listdir(cache_dir or '.'):
+        if i != name and i.startswith(prefix) and i.endswith(suffix):
+            try:
+                os.remove(os.path.join(cache_dir, i))
+            except OSError:
+                pass
+
+
+def _fetch_many(urls: List, cache_dir: str):
+    """ download and extract independent files concurrently """
+    with ThreadPoolExecutor(max_workers=min(8, len(urls))) as executor:
+        list(executor.map(open_compressed_file, urls, repeat(cache_dir)))
 
 
 def wget(url, cache_dir):
-    filename = os.path.basename(url)
-    with open('{}/{}'.format(cache_dir, filename), "wb") as f:
-        r = requests.get(url)
-        f.write(r.content)
-    return '{}/{}'.format(cache_dir, filename)
+    """ download a file to `cache_dir`, streaming the response to disk """
+    path = '{}/{}'.format(cache_dir, os.path.basename(url))
+    with _SESSION.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # undo transfer compression (gzip etc) as `r.content` does
+        with open(path, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1024 * 1024)
+    return path
+
+
+def _get_sudachi():
+    global _SUDACHI
+    if _SUDACHI is None:
+        _SUDACHI = SudachiWrapper()
+    return _SUDACHI
+
+
+def _init_sudachi(label_to_id: Dict):
+    """ set up the Sudachi tokenizer and label dictionaries of the (worker) process for `_fix_ja_one` """
+    global _SUDACHI_WORKER
+    _SUDACHI_WORKER = (_get_sudachi(), label_to_id, {v: k for k, v in label_to_id.items()})
+
+
+def _fix_ja_one(inputs):
+    """ re-tokenize a Japanese sentence with Sudachi and fix its label ids accordingly """
+    label_fixer, label_to_id, id_to_label = _SUDACHI_WORKER
+    x, y = inputs
+    y = [id_to_label[_y] for _y in y]
+    _data, _label = label_fixer.fix_ja_labels(inputs=x, labels=y)
+    return _data, [label_to_id[_y] for _y in _label]
 
 
 def get_dataset_ner(data_names: (List, str) = None,
@@ -155,17 +270,15 @@ def get_dataset_ner(data_names: (List, str) = None,
         languages.append(language)
         unseen_entity_set = ues if len(unseen_entity_set) == 0 else unseen_entity_set.intersection(ues)
     if len(data) > 1:
-        unified_data = {
-            'train': {
-                'data': list(chain(*[d['train']['data'] for d in data])),
-                'label': list(chain(*[d['train']['label'] for d in data]))
-            }
-        }
+        train_data, train_label = [], []
+        for d in data:
+            train_data.extend(d['train']['data'])
+            train_label.extend(d['train']['label'])
+        unified_data = {'train': {'data': train_data, 'label': train_label}}
     else:
         unified_data = data[0]
     # use the most frequent language in the data
-    freq = list(map(lambda x: (x, len(list(filter(lambda y: y == x, languages)))), set(languages)))
-    language = sorted(freq, key=lambda x: x[1], reverse=True)[0][0]
+    language = Counter(languages).most_common(1)[0][0]
     return unified_data, label_to_id, language, unseen_entity_set
 
 
@@ -216,12 +329,6 @@ def get_dataset_ner_single(data_name: str = 'wnut2017',
                         output_file='{}/{}.txt'.format(data_path, i))
     elif data_name == 'bc5cdr':
         files_info = {'train': 'train.txt', 'valid': 'dev.txt', 'test': 'test.txt'}
-        if not os.path.exists(data_path):
-            os.makedirs(data_path, exist_ok=True)
-            url = 'https://github.com/JHnlp/BioCreative-V-CDR-Corpus/raw/master/CDR_Data.zip'
-            open_compressed_file(url, data_path)
-            shutil.move('{}/CDR_Data/CDR.Corpus.v010516'.format(data_path), data_path)
-
         def __process_single(_r):
             title, body = _r.split('\n')[:2]
             entities = _r.split('\n')[2:]
@@ -230,17 +337,14 @@ def get_dataset_ner_single(data_name: str = 'wnut2017',
             _tags = []
             last_end = 0
             for e in entities:
-                start, end = e.split('\t')[1:3]
+                parts = e.split('\t')
                 try:
-                    start, end = int(start), int(end)
-                except ValueError:
+                    start, end = int(parts[1]), int(parts[2])
+                except (ValueError, IndexError):
                     continue
-                mention = e.split('\t')[3]
-                entity_type = e.split('\t')[4]
+                mention, entity_type = parts[3], parts[4]
                 assert text[start:end] == mention
-                _tokens_tmp = list(filter(
-                    lambda _x: len(_x) > 0, map(lambda m: m.replace(' ', ''), re.split(r'\b', text[last_end:start]))
-                ))
+                _tokens_tmp = [m.replace(' ', '') for m in _TOKEN.findall(text[last_end:start])]
                 last_end = end
                 _tokens += _tokens_tmp
                 _tags += ['O'] * len(_tokens_tmp)
@@ -254,21 +358,29 @@ def get_dataset_ner_single(data_name: str = 'wnut2017',
             path = '{0}/{1}'.format(data_path, path)
             with open(path, 'r') as f:
                 raw = list(filter(lambda _x: len(_x) > 0, f.read().split('\n\n')))
-                token_tag = list(map(lambda _x: __process_single(_x), raw))
-                tokens, tags = list(zip(*token_tag))
-                conll_formatting(tokens=tokens, tags=tags, output_file=os.path.join(data_path, export), sentence_division='.')
+            tokens, tags = [], []
+            for r in raw:
+                _tokens, _tags = __process_single(r)
+                tokens.append(_tokens)
+                tags.append(_tags)
+            conll_formatting(tokens=tokens, tags=tags, output_file=os.path.join(data_path, export), sentence_division='.')
 
-        convert_to_iob('CDR.Corpus.v010516/CDR_DevelopmentSet.PubTator.txt', 'dev.txt')
-        convert_to_iob('CDR.Corpus.v010516/CDR_TestSet.PubTator.txt', 'test.txt')
-        convert_to_iob('CDR.Corpus.v010516/CDR_TrainingSet.PubTator.txt', 'train.txt')
+        if not os.path.exists(data_path):
+            os.makedirs(data_path, exist_ok=True)
+            url = 'https://github.com/JHnlp/BioCreative-V-CDR-Corpus/raw/master/CDR_Data.zip'
+            open_compressed_file(url, data_path)
+            shutil.move('{}/CDR_Data/CDR.Corpus.v010516'.format(data_path), data_path)
+            convert_to_iob('CDR.Corpus.v010516/CDR_DevelopmentSet.PubTator.txt', 'dev.txt')
+            convert_to_iob('CDR.Corpus.v010516/CDR_TestSet.PubTator.txt', 'test.txt')
+            convert_to_iob('CDR.Corpus.v010516/CDR_TrainingSet.PubTator.txt', 'train.txt')
     elif data_name == 'bionlp2004':  # https://www.aclweb.org/anthology/W04-1213.pdf
         files_info = {'train': 'Genia4ERtask1.iob2', 'valid': 'Genia4EReval1.iob2'}
         if not os.path.exists(data_path):
             os.makedirs(data_path, exist_ok=True)
-            url = 'http://www.nactem.ac.uk/GENIA/current/Shared-tasks/JNLPBA/Train/Genia4ERtraining.tar.gz'
-            open_compressed_file(url, data_path)
-            url = 'http://www.nactem.ac.uk/GENIA/current/Shared-tasks/JNLPBA/Evaluation/Genia4ERtest.tar.gz'
-            open_compressed_file(url, data_path)
+            _fetch_many([
+                'http://www.nactem.ac.uk/GENIA/current/Shared-tasks/JNLPBA/Train/Genia4ERtraining.tar.gz',
+                'http://www.nactem.ac.uk/GENIA/current/Shared-tasks/JNLPBA/Evaluation/Genia4ERtest.tar.gz'
+            ], data_path)
     elif data_name == 'fin':  # https://www.aclweb.org/anthology/U15-1010.pdf
         files_info = {'train': 'FIN5.txt', 'valid': 'FIN3.txt'}
         if not os.path.exists(data_path):
@@ -282,54 +394,51 @@ def get_dataset_ner_single(data_name: str = 'wnut2017',
         files_info = {'train': 'restauranttrain.bio', 'valid': 'restauranttest.bio'}
         if not os.path.exists(data_path):
             os.makedirs(data_path, exist_ok=True)
-            url = 'https://groups.csail.mit.edu/sls/downloads/restaurant/restauranttrain.bio'
-            open_compressed_file(url, data_path)
-            url = 'https://groups.csail.mit.edu/sls/downloads/restaurant/restauranttest.bio'
-            open_compressed_file(url, data_path)
+            _fetch_many([
+                'https://groups.csail.mit.edu/sls/downloads/restaurant/restauranttrain.bio',
+                'https://groups.csail.mit.edu/sls/downloads/restaurant/restauranttest.bio'
+            ], data_path)
         entity_first = True
     elif data_name == 'mit_movie_trivia':
         files_info = {'train': 'trivia10k13train.bio', 'valid': 'trivia10k13test.bio'}
         if not os.path.exists(data_path):
             os.makedirs(data_path, exist_ok=True)
-            url = 'https://groups.csail.mit.edu/sls/downloads/movie/trivia10k13train.bio'
-            open_compressed_file(url, data_path)
-            url = 'https://groups.csail.mit.edu/sls/downloads/movie/trivia10k13test.bio'
-            open_compressed_file(url, data_path)
+            _fetch_many([
+                'https://groups.csail.mit.edu/sls/downloads/movie/trivia10k13train.bio',
+                'https://groups.csail.mit.edu/sls/downloads/movie/trivia10k13test.bio'
+            ], data_path)
         entity_first = True
     elif data_name == 'wnut2017':
         files_info = {'train': 'train.txt', 'valid': 'valid.txt', 'test': 'test.txt'}
         if not os.path.exists(data_path):
             os.makedirs(data_path, exist_ok=True)
-            url = 'https://github.com/leondz/emerging_entities_17/raw/master/wnut17train.conll'
-            open_compressed_file(url, data_path)
-            with open('{}/wnut17train.conll'.format(data_path), 'r') as f:
-                with open('{}/train.txt'.format(data_path), 'w') as f_w:
-                    f_w.write(f.read().replace('\t', ' '))
-
-            url = 'https://github.com/leondz/emerging_entities_17/raw/master/emerging.dev.conll'
-            open_compressed_file(url, data_path)
-            with open('{}/emerging.dev.conll'.format(data_path), 'r') as f:
-                with open('{}/valid.txt'.format(data_path), 'w') as f_w:
-                    f_w.write(f.read().replace('\t', ' '))
-
-            url = 'https://raw.githubusercontent.com/leondz/emerging_entities_17/master/emerging.test.annotated'
-            open_compressed_file(url, data_path)
-            with open('{}/emerging.test.annotated'.format(data_path), 'r') as f:
-                with open('{}/test.txt'.format(data_path), 'w') as f_w:
-                    f_w.write(f.read().replace('\t', ' '))
+            _fetch_many([
+                'https://github.com/leondz/emerging_entities_17/raw/master/wnut17train.conll',
+                'https://github.com/leondz/emerging_entities_17/raw/master/emerging.dev.conll',
+                'https://raw.githubusercontent.com/leondz/emerging_entities_17/master/emerging.test.annotated'
+            ], data_path)
+            for _file, _export in zip(['wnut17train.conll', 'emerging.dev.conll', 'emerging.test.annotated'],
+                                      ['train.txt', 'valid.txt', 'test.txt']):
+                with open('{}/{}'.format(data_path, _file), 'r') as f:
+                    with open('{}/{}'.format(data_path, _export), 'w') as f_w:
+                        f_w.write(f.read().replace('\t', ' '))
     elif 'panx_dataset' in data_name:
         files_info = {'valid': 'dev.txt', 'train': 'train.txt', 'test': 'test.txt'}
         panx_la = data_name.replace('/', '_').split('_')[-1]
         if not os.path.exists(data_path):
             os.makedirs(data_path, exist_ok=True)
             url = 'https://github.com/asahi417/neighbor-tagging/releases/download/0.0.0/wikiann.zip'
-            open_compressed_file(url, cache_dir)
+            open_compressed_file(url, cache_dir, members=['panx_dataset/{}.tar.gz'.format(panx_la)])
             tar = tarfile.open('{0}/panx_dataset/{1}.tar.gz'.format(cache_dir, panx_la), "r:gz")
             tar.extractall(data_path)
             tar.close()
+            # remove the language prefix (eg. `en:`) from tokens
             for v in files_info.values():
-                os.system("sed -e 's/{0}://g' {1}/{2} > {1}/{2}.txt".format(panx_la, data_path, v.replace('.txt', '')))
-                os.system("rm -rf {0}/{1}".format(data_path, v.replace('.txt', '')))
+                src = '{}/{}'.format(data_path, v.replace('.txt', ''))
+                with open(src, 'rb') as f_r:
+                    with open('{}/{}'.format(data_path, v), 'wb') as f_w:
+                        f_w.write(f_r.read().replace('{}:'.format(panx_la).encode(), b''))
+                os.remove(src)
         if panx_la == 'ja':
             language = 'ja'
             post_process_ja = True
@@ -356,30 +465,58 @@ def get_dataset_ner_single(data_name: str = 'wnut2017',
             logging.info('note that files should be named as either `valid.txt`, `test.txt`, or `train.txt` ')
 
     label_to_id = dict() if label_to_id is None else label_to_id
+    # the whole pipeline output is cached, so repeated calls skip decoding and post-processing entirely
+    config_key, file_key = _cache_key(
+        [os.path.join(data_path, v) for v in files_info.values()], files_info, fix_label_dict, entity_first, to_bio,
+        allow_new_entity, post_process_ja, lower_case, label_to_id)
+    # caches are named by the config (eg. training and evaluation keep their own), and only outdated caches of the
+    # same config are removed when the files change
+    cache_prefix = '{}{}.'.format(_SPLIT_CACHE_PREFIX, config_key)
+    cache_file = os.path.join(data_path, '{}{}{}'.format(cache_prefix, file_key, _SPLIT_CACHE_SUFFIX))
+    cached = _load_cache(cache_file)
+    if cached is not None:
+        logging.info('load cached dataset: {}'.format(cache_file))
+        data_split_all, _label_to_id, unseen_entity_set = cached
+        label_to_id.update(_label_to_id)
+        return data_split_all, label_to_id, language, unseen_entity_set
+
     data_split_all, unseen_entity_set, label_to_id = decode_all_files(
         files_info, data_path, label_to_id=label_to_id, fix_label_dict=fix_label_dict, entity_first=entity_first,
         to_bio=to_bio, allow_new_entity=allow_new_entity)
 
     if post_process_ja:
         logging.info('Japanese tokenization post processing')
-        id_to_label = {v: k for k, v in label_to_id.items()}
-        label_fixer = SudachiWrapper()
-        data, label = [], []
-        for k, v in data_split_all.items():
-            for x, y in tqdm(zip(v['data'], v['label'])):
-                y = [id_to_label[_y] for _y in y]
-                _data, _label = label_fixer.fix_ja_labels(inputs=x, labels=y)
-                _label = [label_to_id[_y] for _y in _label]
-                data.append(_data)
-                label.append(_label)
-            v['data'] = data
-            v['label'] = label
+        # Sudachi tokenization is CPU-bound, so sentences are processed in a process pool (TNER_JA_WORKERS=1 to disable)
+        n_worker = int(os.getenv('TNER_JA_WORKERS', os.cpu_count() or 1))
+        executor = None
+        if n_worker > 1:
+            executor = ProcessPoolExecutor(max_workers=n_worker, initializer=_init_sudachi, initargs=(label_to_id,))
+            _map = partial(executor.map, chunksize=64)
+        else:
+            _init_sudachi(label_to_id)
+            _map = map
+        # the fix is deterministic, so duplicated sentences (within and across splits) are processed only once
+        cache = {}
+        try:
+            for k, v in data_split_all.items():
+                inputs = [(tuple(x), tuple(y)) for x, y in zip(v['data'], v['label'])]
+                new_inputs = [i for i in dict.fromkeys(inputs) if i not in cache]
+                cache.update(zip(new_inputs, tqdm(_map(_fix_ja_one, new_inputs), total=len(new_inputs))))
+                v['data'] = [list(cache[i][0]) for i in inputs]
+                v['label'] = [list(cache[i][1]) for i in inputs]
+        finally:
+            # shut the workers down on failure as well
+            if executor is not None:
+                executor.shutdown()
+        cache.clear()
 
     if lower_case:
         logging.info('convert into lower cased')
         data_split_all = {
-            k: {'data': [[ii.lower() for ii in i] for i in v['data']], 'label': v['label']}
+            k: {'data': [list(map(_lower, i)) for i in v['data']], 'label': v['label']}
             for k, v in data_split_all.items()}
+    _dump_cache((data_split_all, label_to_id, unseen_entity_set), cache_file,
+                prefix=cache_prefix, suffix=_SPLIT_CACHE_SUFFIX)
     return data_split_all, label_to_id, language, unseen_entity_set
 
 
@@ -390,73 +527,84 @@ def decode_file(file_name: str,
                 entity_first: bool = False,
                 to_bio: bool = False,
                 allow_new_entity: bool = False):
-    inputs, labels, seen_entity = [], [], []
+    """ decode a CoNLL-format file """
+    path = os.path.join(data_path, file_name)
+
+    def fix_tag(_tag, _past_mention):
+        """ convert tag into unified label set, return the tag and its raw mention """
+        if _tag == 'O':
+            return _tag, 'O'
+        location = _tag.split('-')[0]
+        mention = '-'.join(_tag.split('-')[1:])
+        if to_bio and mention == _past_mention:
+            location = 'I'
+        elif to_bio:
+            location = 'B'
+        fixed_mention = _SURFACE_TO_CANONICAL.get(mention)
+        if fixed_mention is None and allow_new_entity:
+            return '-'.join([location, mention]), mention
+        elif fixed_mention is None:
+            return 'O', mention
+        return '-'.join([location, fixed_mention]), mention
+
+    inputs, labels = [], []
+    seen_ids = set()
+    fixed_tags = {}
     past_mention = 'O'
-    with open(os.path.join(data_path, file_name), 'r') as f:
-        sentence, entity = [], []
-        for n, line in enumerate(f):
-            line = line.strip()
-            if len(line) == 0 or line.startswith("-DOCSTART-"):
-                if len(sentence) != 0:
-                    assert len(sentence) == len(entity)
-                    inputs.append(sentence)
-                    labels.append(entity)
-                    sentence, entity = [], []
-            else:
-                ls = line.split()
-                if len(ls) < 2:
-                    continue
-                # Examples could have no label for mode = "test"
-                if entity_first:
-                    tag, word = ls[0], ls[-1]
-                else:
-                    word, tag = ls[0], ls[-1]
-                if tag == 'junk':
-                    continue
-                if word in STOPWORDS:
-                    continue
-                sentence.append(word)
-
-                # convert tag into unified label set
-                if tag != 'O':  # map tag by custom dictionary
-                    location = tag.split('-')[0]
-                    mention = '-'.join(tag.split('-')[1:])
-                    if to_bio and mention == past_mention:
-                        location = 'I'
-                    elif to_bio:
-                        location = 'B'
-
-                    fixed_mention = [k for k, v in SHARED_NER_LABEL.items() if mention in v]
-                    if len(fixed_mention) == 0 and allow_new_entity:
-                        tag = '-'.join([location, mention])
-                    elif len(fixed_mention) == 0:
-                        tag = 'O'
-                    else:
-                        tag = '-'.join([location, fixed_mention[0]])
-                    past_mention = mention
-                else:
-                    past_mention = 'O'
-
+    with open(path, 'r') as f:
+        blocks = _SENTENCE_BOUNDARY.split(f.read())
+    for n, block in enumerate(blocks):
+        # Examples could have no label for mode = "test"
+        rows = [ls for ls in map(str.split, block.split('\n')) if len(ls) > 1]
+        if entity_first:
+            rows = [(ls[-1], ls[0]) for ls in rows]
+        else:
+            rows = [(ls[0], ls[-1]) for ls in rows]
+        rows = [(word, tag) for word, tag in rows if tag != 'junk' and word not in STOPWORDS]
+        if len(rows) == 0:
+            continue
+        sentence = [word for word, _ in rows]
+        if to_bio:
+            tags = []
+            for _, tag in rows:
+                tag, past_mention = fix_tag(tag, past_mention)
+                tags.append(tag)
+        else:
+            for _, tag in rows:
+                if tag not in fixed_tags:
+                    fixed_tags[tag] = fix_tag(tag, None)[0]
+            tags = [fixed_tags[tag] for _, tag in rows]
+
+        entity = []
+        for tag in tags:
+            tag_id = label_to_id.get(tag)
+            if tag_id is None:
                 # if label dict is fixed, unknown tag type will be ignored
-                if tag not in label_to_id.keys() and fix_label_dict:
-                    tag = 'O'
-                elif tag not in label_to_id.keys() and not fix_label_dict:
-                    label_to_id[tag] = len(label_to_id)
-
-                entity.append(label_to_id[tag])
+                if fix_label_dict:
+                    tag_id = label_to_id['O']
+                else:
+                    tag_id = label_to_id[tag] = len(label_to_id)
+            entity.append(tag_id)
+        # a sentence is only complete once it is followed by a boundary, so the trailing block is not kept
+        if n < len(blocks) - 1:
+            inputs.append(sentence)
+            labels.append(entity)
+            seen_ids.update(entity)
 
     id_to_label = {v: k for k, v in label_to_id.items()}
-    unseen_entity_id = set(label_to_id.values()) - set(list(chain(*labels)))
+    unseen_entity_id = set(label_to_id.values()) - seen_ids
     unseen_entity_label = {id_to_label[i] for i in unseen_entity_id}
-    return label_to_id, unseen_entity_label, {"data": inputs, "label": labels}
+    data_dict = {"data": inputs, "label": labels}
+    return label_to_id, unseen_entity_label, data_dict
 
 
 def decode_all_files(files: Dict, data_path: str, label_to_id: Dict, fix_label_dict: bool, entity_first: bool = False,
                      to_bio: bool = False, allow_new_entity: bool = False):
     data_split = dict()
     unseen_entity = None
+    # `label_to_id` is updated in place by `decode_file` and shared across the splits
     for name, filepath in files.items():
-        label_to_id, unseen_entity_set, data_dict = decode_file(
+        _, unseen_entity_set, data_dict = decode_file(
             filepath, data_path=data_path, label_to_id=label_to_id, fix_label_dict=fix_label_dict,
             entity_first=entity_first, to_bio=to_bio, allow_new_entity=allow_new_entity)
         if unseen_entity is None:
@@ -464,7 +612,7 @@ def decode_all_files(files: Dict, data_path: str, label_to_id: Dict, fix_label_d
         else:
             unseen_entity = unseen_entity.intersection(unseen_entity_set)
         data_split[name] = data_dict
-        logging.info('dataset {0}/{1}: {2} entries'.format(data_path, filepath, len(data_dict['data'])))
+        logging.info('dataset %s/%s: %d entries', data_path, filepath, len(data_dict['data']))
     return data_split, unseen_entity, label_to_id
 
 
@@ -483,19 +631,28 @@ def conll_formatting(output_file: str,
             tags = [i.split(' ') for i in f.read().split('\n')]
     assert tokens and tags
     _end = False
-    with open(output_file, 'w') as f:
+    buffer = []
+    with open(output_file, 'w', buffering=1 << 20) as f:
         assert len(tokens) == len(tags)
-        for _token, _tag in zip(tokens, tags):
+        for n, (_token, _tag) in enumerate(zip(tokens, tags)):
             assert len(_token) == len(_tag)
-            for __token, __tag in zip(_token, _tag):
-                _end = False
-                f.write('{0} {1}\n'.format(__token, __tag))
-                if sentence_division and __token == sentence_division:
-                    f.write('\n')
-                    _end = True
+            if sentence_division:
+                # a blank line is put after every division token
+                buffer.append(''.join(
+                    '{0} {1}\n\n'.format(__token, __tag) if __token == sentence_division else
+                    '{0} {1}\n'.format(__token, __tag) for __token, __tag in zip(_token, _tag)))
+                if len(_token) > 0:
+                    _end = _token[-1] == sentence_division
+            else:
+                buffer.append(''.join('{0} {1}\n'.format(__token, __tag) for __token, __tag in zip(_token, _tag)))
+                if len(_token) > 0:
+                    _end = False
             if _end:
                 _end = False
             else:
-                f.write('\n')
+                buffer.append('\n')
                 _end = True
-
+            if n % 1024 == 1023:
+                f.write(''.join(buffer))
+                buffer = []
+        f.write(''.join(buffer))
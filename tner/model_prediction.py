@@ -1,26 +1,53 @@
+import os
 import logging
+import hashlib
+import tempfile
 from typing import List
+from functools import partial
 from itertools import groupby
 import transformers
 import torch
 from torch import nn
 from torch.utils.tensorboard import SummaryWriter
 
-from .tokenizer import Transforms, Dataset
+from .tokenizer import Transforms
+from .get_dataset import CACHE_DIR
 
+BACKENDS = ['pt', 'onnx', 'onnx-int8']
+DTYPES = {'fp32': torch.float32, 'fp16': torch.float16, 'bf16': torch.bfloat16}
 __all__ = 'TransformersNER'
 
 
 class TransformersNER:
     """ Named-Entity-Recognition (NER) API for an inference """
 
-    def __init__(self, transformers_model: str, cache_dir: str = None):
+    def __init__(self,
+                 transformers_model: str,
+                 cache_dir: str = None,
+                 quantize: bool = False,
+                 backend: str = 'pt',
+                 device: str = None,
+                 dtype: str = 'fp32',
+                 torch_compile: bool = False):
         """ Named-Entity-Recognition (NER) API for an inference
 
          Parameter
         ------------
         transformers_model: str
             model name on transformers model hub or path to model directory
+        cache_dir: str
+            cache directory for transformers
+        quantize: bool
+            apply dynamic int8 quantization to linear layers (CPU only)
+        backend: str
+            inference backend, 'pt' (pytorch), 'onnx' (onnxruntime), or 'onnx-int8' (onnxruntime with dynamic int8
+            quantization), onnxruntime backends run on CPU
+        device: str
+            device to run the model ('cpu' or 'cuda'), use GPU if available when not specified
+        dtype: str
+            precision of the model weights, 'fp32', 'fp16' (GPU only), or 'bf16'
+        torch_compile: bool
+            compile the model with `torch.compile` (torch>=2.0, pytorch backend only) to fuse kernels
         """
         logging.info('*** initialize network ***')
         self.model = transformers.AutoModelForTokenClassification.from_pretrained(transformers_model)
@@ -30,7 +57,115 @@ class TransformersNER:
         # GPU allocation
         self.n_gpu = torch.cuda.device_count()
         self.device = 'cuda' if self.n_gpu > 0 else 'cpu'
-        self.model.to(self.device)
+        if device is not None:
+            self.device = device
+            self.n_gpu = self.n_gpu if device.startswith('cuda') else 0
+        assert backend in BACKENDS, 'unknown backend: {} not in {}'.format(backend, BACKENDS)
+        assert dtype in DTYPES, 'unknown dtype: {} not in {}'.format(dtype, list(DTYPES.keys()))
+        assert not (quantize and backend != 'pt'), 'use `onnx-int8` backend for quantization with onnxruntime'
+        assert dtype == 'fp32' or not (quantize or backend != 'pt'), 'quantization and onnx backends run on fp32'
+        assert dtype != 'fp16' or self.device != 'cpu', 'fp16 is not supported on CPU, use bf16 instead'
+        if quantize or backend != 'pt':
+            if self.device != 'cpu':
+                logging.warning('dynamic quantization and onnxruntime are only supported on CPU, run on CPU')
+                self.n_gpu, self.device = 0, 'cpu'
+        if quantize:
+            self.model = torch.quantization.quantize_dynamic(self.model, {nn.Linear}, dtype=torch.qint8)
+        self.model.to(self.device, dtype=DTYPES[dtype])
+        self.session = None
+        if backend != 'pt':
+            self.session = self.__setup_onnx(transformers_model, quantize=backend == 'onnx-int8')
+        elif self.n_gpu > 1 and device is None:
+            # multi-gpus: each batch is split across the GPUs, unless a specific device is requested
+            self.model = torch.nn.DataParallel(self.model)
+            logging.info('using `torch.nn.DataParallel`')
+        logging.info('running on {}'.format(self.device))
+        if torch_compile and backend == 'pt':
+            if hasattr(torch, 'compile'):
+                self.model = torch.compile(self.model, mode='reduce-overhead', dynamic=True)
+                # trigger compilation before the first actual inference
+                self.predict(['warm up torch compile'])
+            else:
+                logging.warning('`torch.compile` is not available (torch>=2.0 is required), skip compiling')
+
+    def __setup_onnx(self, transformers_model: str, quantize: bool):
+        """ export the model to ONNX and load it as onnxruntime session, the exported model is cached """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError('please install onnxruntime to use onnx backend: `pip install tner[onnx]`')
+        # cache is keyed by the model (the hub revision, or the checkpoint files if it is a local directory) and
+        # library versions
+        key = [transformers_model, getattr(self.model.config, '_commit_hash', None),
+               torch.__version__, transformers.__version__, onnxruntime.__version__]
+        if os.path.isdir(transformers_model):
+            key += sorted((i.name, i.stat().st_mtime_ns, i.stat().st_size) for i in os.scandir(transformers_model))
+        export_dir = os.path.join(CACHE_DIR, 'onnx', hashlib.blake2b(repr(key).encode()).hexdigest()[:16])
+        path = os.path.join(export_dir, 'model.int8.onnx' if quantize else 'model.onnx')
+        if not os.path.exists(path):
+            os.makedirs(export_dir, exist_ok=True)
+            self.__export_onnx(export_dir, quantize)
+        logging.info('load onnx model: {}'.format(path))
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def __export_onnx(self, export_dir: str, quantize: bool):
+        """ export the model to `export_dir`/model.onnx (and model.int8.onnx if quantize) """
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        def tmp_file():
+            # unique per process, so that concurrent exports don't write into the same file
+            fd, tmp = tempfile.mkstemp(dir=export_dir, suffix='.tmp')
+            os.close(fd)
+            return tmp
+
+        path = os.path.join(export_dir, 'model.onnx')
+        if not os.path.exists(path):
+            logging.info('export model to onnx: {}'.format(path))
+            self.model.eval()
+            dummy = self.transforms.tokenizer('get onnx graph', return_tensors='pt')
+            # trace tuple output instead of ModelOutput
+            return_dict, self.model.config.return_dict = self.model.config.return_dict, False
+            tmp = tmp_file()
+            try:
+                torch.onnx.export(
+                    self.model,
+                    (dummy['input_ids'], dummy['attention_mask']),
+                    tmp,
+                    input_names=['input_ids', 'attention_mask'],
+                    output_names=['logits'],
+                    dynamic_axes={k: {0: 'batch', 1: 'seq'} for k in ['input_ids', 'attention_mask', 'logits']},
+                    opset_version=14)  # scaled_dot_product_attention is exported from opset 14
+            finally:
+                self.model.config.return_dict = return_dict
+            os.replace(tmp, path)
+        if quantize:
+            tmp = tmp_file()
+            quantize_dynamic(path, tmp, weight_type=QuantType.QInt8)
+            os.replace(tmp, os.path.join(export_dir, 'model.int8.onnx'))
+
+    def __forward(self, encode):
+        """ compute probability and argmax of a batch, on GPU the result is copied to host asynchronously and the
+        returned event has to be synchronized before reading it """
+        if self.session is not None:
+            logit = self.session.run(['logits'], {
+                'input_ids': encode['input_ids'].long().numpy(),
+                'attention_mask': encode['attention_mask'].long().numpy()})[0]
+            logit = torch.from_numpy(logit)
+        else:
+            with torch.no_grad():
+                encode = {k: v.to(self.device, non_blocking=True) for k, v in encode.items()}
+                logit = self.model(**encode, return_dict=True)['logits']
+        prob, pred = torch.max(nn.Softmax(dim=-1)(logit.float()), dim=-1)
+        if not prob.is_cuda:
+            return prob, pred, None
+        # queue the transfer into pinned memory behind the forward and return without waiting for it
+        prob_host = torch.empty(prob.shape, dtype=prob.dtype, pin_memory=True).copy_(prob, non_blocking=True)
+        pred_host = torch.empty(pred.shape, dtype=pred.dtype, pin_memory=True).copy_(pred, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record(torch.cuda.current_stream(prob.device))
+        return prob_host, pred_host, event
 
     @staticmethod
     def decode_ner_tags(tag_sequence, tag_probability, non_entity: str = 'O'):
@@ -55,7 +190,7 @@ class TransformersNER:
         result = sorted(result, key=lambda x: x[1][0])
         return result
 
-    def predict(self, x: List, max_seq_length: int = 128):
+    def predict(self, x: List, max_seq_length: int = 128, batch_size: int = 16, num_workers: int = 0):
         """ Get prediction
 
          Parameter
@@ -64,6 +199,10 @@ class TransformersNER:
             batch of input texts
         max_seq_length: int
             maximum sequence length for running an inference
+        batch_size: int
+            batch size for running an inference (the input is processed by chunks of this size)
+        num_workers: int
+            number of worker processes to tokenize upcoming batches while the model runs
 
          Return
         ----------------
@@ -74,18 +213,47 @@ class TransformersNER:
                 'mention': (str) mention
         """
         self.model.eval()
-        encode_list = self.transforms.encode_plus_all(x, max_length=max_seq_length)
-        data_loader = torch.utils.data.DataLoader(Dataset(encode_list), batch_size=len(encode_list))
-        encode = list(data_loader)[0]
-        logit = self.model(**{k: v.to(self.device) for k, v in encode.items()}, return_dict=True)['logits']
+        # sort by length and pad each batch to its longest input, so that short inputs don't waste compute on padding
+        order = sorted(range(len(x)), key=lambda i: len(x[i]))
+        data_loader = torch.utils.data.DataLoader(
+            [x[i] for i in order], batch_size=batch_size,
+            # bind the tokenizer only, so that workers don't need to pickle the model (or onnxruntime session)
+            collate_fn=partial(self.transforms.tokenizer, max_length=max_seq_length, padding=True, truncation=True,
+                               return_tensors='pt'),
+            num_workers=num_workers,
+            pin_memory=self.device != 'cpu')
         entities = []
-        for n, e in enumerate(encode['input_ids'].cpu().tolist()):
-            sentence = self.transforms.tokenizer.decode(e, skip_special_tokens=True)
+        previous = None
+        for encode in data_loader:
+            output = self.__forward(encode)
+            # the current batch is queued on GPU, so decode the previous one on CPU in the meantime
+            if previous is not None:
+                entities += self.__decode_batch(*previous)
+            previous = (encode, *output)
+        if previous is not None:
+            entities += self.__decode_batch(*previous)
+        # restore the input order
+        entities_ordered = [None] * len(entities)
+        for i, _entities in zip(order, entities):
+            entities_ordered[i] = _entities
+        return entities_ordered
 
-            pred = torch.max(logit[n], dim=-1)[1].cpu().tolist()
-            activated = nn.Softmax(dim=-1)(logit[n])
-            prob = torch.max(activated, dim=-1)[0].cpu().tolist()
-            pred = [self.id_to_label[_p] for _p in pred]
+    def __decode_batch(self, encode, prob_batch, pred_batch, event=None):
+        """ convert a batch of model output into the list of entities """
+        entities = []
+        if event is not None:
+            # wait only for the transfer of this batch, not for the batches queued after it
+            event.synchronize()
+        prob_batch, pred_batch = prob_batch.tolist(), pred_batch.tolist()
+        lengths = encode['attention_mask'].sum(-1).tolist()
+        left_padding = self.transforms.tokenizer.padding_side == 'left'
+        for n, e in enumerate(encode['input_ids'].tolist()):
+            # drop the padding, so that the result doesn't depend on the other inputs in the batch
+            first, last = (len(e) - lengths[n], len(e)) if left_padding else (0, lengths[n])
+            e = e[first:last]
+            sentence = self.transforms.tokenizer.decode(e, skip_special_tokens=True)
+            prob = prob_batch[n][first:last]
+            pred = list(map(self.id_to_label.__getitem__, pred_batch[n][first:last]))
             tag_lists = self.decode_ner_tags(pred, prob)
 
             _entities = []
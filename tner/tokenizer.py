@@ -35,7 +35,8 @@ class Transforms:
 
     def __init__(self, transformer_tokenizer: str, cache_dir: str = None):
         """ NER specific transform pipeline """
-        self.tokenizer = transformers.AutoTokenizer.from_pretrained(transformer_tokenizer, cache_dir=cache_dir)
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(
+            transformer_tokenizer, cache_dir=cache_dir, use_fast=True)
         self.pad_ids = {"labels": PAD_TOKEN_LABEL_ID, "input_ids": self.tokenizer.pad_token_id, "__default__": 0}
         self.prefix = self.__sp_token_prefix()
         # find special tokens to be added
@@ -119,7 +120,7 @@ class Transforms:
         if labels is None:
             return self.tokenizer.encode_plus(
                 tokens, max_length=max_length,
-                padding='max_length' if pad_to_max_length else None,
+                padding='max_length' if pad_to_max_length else False,
                 truncation=True)
         if language == 'ja':
             return self.fixed_encode_ja(tokens, labels, max_length)
@@ -3,12 +3,23 @@ import logging
 import argparse
 from pprint import pprint
 
+import torch
+
 from tner import TransformersNER
+from tner.model_prediction import BACKENDS, DTYPES
 
 
 def get_options():
     parser = argparse.ArgumentParser(description='command line tool to test finetuned NER model',)
     parser.add_argument('-c', '--checkpoint', help='checkpoint to load', default=None, type=str)
+    parser.add_argument('--quantize', help='dynamic int8 quantization (CPU only)', action='store_true')
+    parser.add_argument('--backend', help='inference backend', default='pt', choices=BACKENDS)
+    parser.add_argument('--device', help='device (use GPU if available when not specified)', default=None, type=str)
+    parser.add_argument('--dtype', help='model precision (bf16 runs on CPU as well)', default='fp32',
+                        choices=list(DTYPES))
+    parser.add_argument('--compile', help='compile model with `torch.compile`', action='store_true')
+    parser.add_argument('--num-workers', help='number of workers to tokenize upcoming batches', default=0, type=int)
+    parser.add_argument('--num-threads', help='number of CPU threads for intra-op parallelism', default=None, type=int)
     parser.add_argument('--debug', help='show debug log', action='store_true')
     return parser.parse_args()
 
@@ -17,13 +28,17 @@ def main():
     opt = get_options()
     level = logging.DEBUG if opt.debug else logging.INFO
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=level, datefmt='%Y-%m-%d %H:%M:%S')
-    classifier = TransformersNER(opt.checkpoint)
+    if opt.num_threads is not None:
+        torch.set_num_threads(opt.num_threads)
+    classifier = TransformersNER(
+        opt.checkpoint, quantize=opt.quantize, backend=opt.backend, device=opt.device, dtype=opt.dtype,
+        torch_compile=opt.compile)
     test_sentences = [
         'I live in United States.',
         'I have an Apple computer.',
         'I like to eat an apple.'
     ]
-    test_result = classifier.predict(test_sentences)
+    test_result = classifier.predict(test_sentences, num_workers=opt.num_workers)
     pprint('-- DEMO --')
     pprint(test_result)
     pprint('----------')
@@ -34,7 +49,7 @@ def main():
         elif _inp == '':
             continue
         else:
-            pprint(classifier.predict([_inp]))
+            pprint(classifier.predict([_inp], num_workers=opt.num_workers))
 
 
 if __name__ == '__main__':